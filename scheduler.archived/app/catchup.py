@@ -1,100 +1,193 @@
 """Catch-up mechanism for posts that missed their scheduled time.
 
 On startup and periodically (every 5 minutes), queries the Next.js API for posts
-with status="scheduled" whose scheduled_at is in the past, and re-registers them
-with APScheduler to fire after a short delay.
+with status="scheduled" whose scheduled_at is in the past (via GET /posts/missed,
+falling back to GET /posts?status=scheduled on older APIs), and re-registers them
+with APScheduler to fire after a short delay, staggered so a large backlog does
+not hit n8n all at once.
+
+The catch-up itself is a coroutine that APScheduler runs directly on the FastAPI
+event loop, so a slow API response never ties up a publish worker thread.
 """
 
+import asyncio
 import logging
 from datetime import datetime, timedelta, timezone
 
 import httpx
+import orjson
+from pydantic import TypeAdapter, ValidationError
 
 from app.config import settings
-from app.jobs import trigger_linkedin_publish
-from app.scheduler import get_scheduler
+from app.models import CatchupPost
+from app.scheduler import add_publish_jobs, find_existing_job_ids, post_job_id
 
 logger = logging.getLogger(__name__)
 
 CATCHUP_DELAY_SECONDS = 30
+CATCHUP_STAGGER_SECONDS = 2  # spacing between recovered posts to avoid a burst at n8n
 CATCHUP_INTERVAL_SECONDS = 300  # 5 minutes
 
+# Cleared the first time the API answers 404, so later ticks go straight to /posts
+_use_missed_endpoint = True
+
+# Shared API client, reused across cycles so each run skips the TCP/TLS handshake
+_client: httpx.AsyncClient | None = None
+
+# Validators from the last full response, sent back so an unchanged list comes
+# back as 304 Not Modified. The Sunday API does not emit ETag/Last-Modified yet;
+# until it does, every tick is a full 200.
+_last_etag: str | None = None
+_last_modified: str | None = None
+
+# Validates and parses the whole payload in one pass
+_posts_adapter = TypeAdapter(list[CatchupPost])
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Lazily create the pooled HTTP/2 client for the Next.js API."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=settings.sunday_api_url,
+            http2=True,
+            timeout=15.0,
+            limits=httpx.Limits(max_keepalive_connections=4),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared API client (called on application shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
 
-def recover_missed_posts() -> int:
+
+def _validate_posts(raw_posts: list) -> list[CatchupPost]:
+    """Parse the API payload, dropping (and logging once) any rows that fail validation."""
+    try:
+        return _posts_adapter.validate_python(raw_posts)
+    except ValidationError as exc:
+        invalid = {err["loc"][0] for err in exc.errors() if err["loc"]}
+        logger.warning(
+            "Skipping %d malformed post(s) in catch-up response: %s",
+            len(invalid), exc,
+        )
+        return _posts_adapter.validate_python(
+            [post for index, post in enumerate(raw_posts) if index not in invalid]
+        )
+
+
+async def _fetch_due_posts(now: datetime, headers: dict[str, str]) -> httpx.Response:
+    """
+    Fetch past-due scheduled posts.
+
+    GET /posts/missed returns only the posts that actually missed their slot, so the
+    payload scales with the backlog rather than with everything scheduled. APIs
+    without that endpoint get the broader /posts?status=scheduled query instead.
+    """
+    global _use_missed_endpoint
+
+    client = _get_client()
+    if _use_missed_endpoint:
+        response = await client.get("/posts/missed", headers=headers)
+        if response.status_code != 404:
+            return response
+        logger.info("API has no /posts/missed endpoint, falling back to /posts?status=scheduled")
+        _use_missed_endpoint = False
+
+    return await client.get(
+        "/posts",
+        # Let the API drop future posts; the check below stays as a safety net
+        params={"status": "scheduled", "scheduledBefore": now.isoformat()},
+        headers=headers,
+    )
+
+
+async def recover_missed_posts() -> int:
     """
     Query the Next.js API for scheduled posts that are past due,
-    and re-register them with APScheduler.
+    and re-register them with APScheduler in a single batch.
 
     Returns the number of recovered posts.
     """
-    sched = get_scheduler()
-    recovered = 0
+    global _last_etag, _last_modified
+
+    pending: list[tuple[str, datetime, str]] = []
     now = datetime.now(timezone.utc)
+    # Compare plain floats in the loop rather than tz-aware datetimes
+    now_ts = now.timestamp()
+    base_run_date = now + timedelta(seconds=CATCHUP_DELAY_SECONDS)
+
+    headers = {}
+    if _last_etag:
+        headers["If-None-Match"] = _last_etag
+    if _last_modified:
+        headers["If-Modified-Since"] = _last_modified
 
     try:
-        with httpx.Client() as client:
-            response = client.get(
-                f"{settings.sunday_api_url}/posts",
-                params={"status": "scheduled"},
-                timeout=15.0,
-            )
-            response.raise_for_status()
-            posts = response.json()
+        response = await _fetch_due_posts(now, headers)
+        if response.status_code == 304:
+            # Nothing changed server-side. The last list only held posts that were
+            # already due, and those were registered then, so there is nothing to do.
+            logger.info("Catch-up complete: missed-post list unchanged")
+            return 0
+        response.raise_for_status()
+        raw_posts = orjson.loads(response.content)
     except httpx.HTTPError as exc:
         logger.error("Failed to fetch scheduled posts for catch-up: %s", exc)
         return 0
 
-    if not isinstance(posts, list):
+    if not isinstance(raw_posts, list):
         # API might wrap in an object — handle both {"posts": [...]} and [...]
-        posts = posts.get("posts", []) if isinstance(posts, dict) else []
+        raw_posts = raw_posts.get("posts", []) if isinstance(raw_posts, dict) else []
+    posts = _validate_posts(raw_posts)
 
+    due: list[tuple[CatchupPost, datetime]] = []
     for post in posts:
-        post_id = post.get("id")
-        scheduled_at_raw = post.get("scheduledAt") or post.get("scheduled_at")
-        if not post_id or not scheduled_at_raw:
-            continue
-
-        # Parse the scheduled time
-        try:
-            if isinstance(scheduled_at_raw, str):
-                # Handle both ISO formats with and without Z suffix
-                scheduled_at_str = scheduled_at_raw.replace("Z", "+00:00")
-                scheduled_at = datetime.fromisoformat(scheduled_at_str)
-            else:
-                continue
-        except (ValueError, TypeError):
-            logger.warning("Could not parse scheduled_at for post %s: %s", post_id, scheduled_at_raw)
-            continue
-
-        # Ensure timezone-aware
+        scheduled_at = post.scheduled_at
+        # Treat naive timestamps as UTC
         if scheduled_at.tzinfo is None:
             scheduled_at = scheduled_at.replace(tzinfo=timezone.utc)
 
         # Only recover posts that are past due
-        if scheduled_at >= now:
+        if scheduled_at.timestamp() >= now_ts:
             continue
 
-        job_id = f"post-{post_id}"
+        due.append((post, scheduled_at))
+
+    # Probe the jobstore for every candidate in one query instead of per post
+    existing_ids = await asyncio.to_thread(
+        find_existing_job_ids, [post_job_id(post.id) for post, _ in due]
+    )
+
+    for post, scheduled_at in due:
+        post_id = post.id
+        job_id = post_job_id(post_id)
 
         # Skip if already registered in APScheduler
-        if sched.get_job(job_id):
+        if job_id in existing_ids:
             logger.debug("Post %s already has a pending job, skipping", post_id)
             continue
 
-        run_date = now + timedelta(seconds=CATCHUP_DELAY_SECONDS)
-        sched.add_job(
-            trigger_linkedin_publish,
-            trigger="date",
-            run_date=run_date,
-            args=[post_id],
-            id=job_id,
-            replace_existing=True,
-        )
-        recovered += 1
-        logger.info(
-            "Recovered missed post %s (was due %s, rescheduled to %s)",
-            post_id, scheduled_at.isoformat(), run_date.isoformat(),
-        )
+        run_date = base_run_date + timedelta(seconds=len(pending) * CATCHUP_STAGGER_SECONDS)
+        pending.append((job_id, run_date, post_id))
+        existing_ids.add(job_id)
+        # Guarded so the isoformat() calls are skipped when INFO is disabled
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Recovered missed post %s (was due %s, rescheduled to %s)",
+                post_id, scheduled_at.isoformat(), run_date.isoformat(),
+            )
+
+    await asyncio.to_thread(add_publish_jobs, pending)
+    # Only now is the list fully registered; remembering its validators any earlier
+    # would let a failed registration be answered with 304 on every later tick
+    _last_etag = response.headers.get("ETag")
+    _last_modified = response.headers.get("Last-Modified")
+    recovered = len(pending)
 
     if recovered:
         logger.info("Catch-up complete: recovered %d missed post(s)", recovered)
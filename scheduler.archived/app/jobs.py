@@ -1,134 +1,327 @@
+import asyncio
 import logging
-import time
+import random
 from datetime import datetime, timedelta, timezone
 
 import httpx
+import orjson
 
 from app.config import settings
+from app.scheduler import get_scheduler, post_job_id
 
 logger = logging.getLogger(__name__)
 
 MAX_RETRIES = 3
-RETRY_DELAY_SECONDS = 120  # 2 minutes
+RETRY_BASE_SECONDS = 30
+MAX_RETRY_DELAY_SECONDS = 1800  # 30 minutes
 
-# In-memory retry tracker: post_id -> retry count
-_retry_counts: dict[str, int] = {}
+# Only this much of a response body is read and logged
+BODY_LOG_LIMIT = 512
 
+# errorMessage is clamped to this many characters before it is sent to the API
+MAX_ERROR_MESSAGE_LENGTH = 512
 
-def get_retry_count(post_id: str) -> int:
-    """Get current retry count for a post."""
-    return _retry_counts.get(post_id, 0)
+# Request bodies are serialized with orjson and sent as raw bytes; the "publishing"
+# PATCH never varies, so it is serialized once
+_POSTS_BASE_URL = f"{settings.sunday_api_url}/posts/"
+_PUBLISHING_BODY = b'{"status":"publishing"}'
+_JSON_HEADERS = {"Content-Type": "application/json"}
+# n8n is asked for an unencoded body, so the raw bytes read off the stream are the
+# body itself and the logged head never needs a decompressor
+_N8N_HEADERS = {**_JSON_HEADERS, "Accept-Encoding": "identity"}
 
+# Failed-marks landing within this window are sent to the API as one bulk request
+FAIL_BATCH_WINDOW_SECONDS = 0.05
 
-def clear_retry_count(post_id: str) -> None:
-    """Clear retry tracking for a post (on success or after giving up)."""
-    _retry_counts.pop(post_id, None)
+# Bulk-fail responses meaning the API has no such endpoint (a POST to /posts/bulk-fail
+# lands on the /posts/[id] route, which has no POST handler)
+BULK_FAIL_UNSUPPORTED_STATUSES = frozenset({404, 405, 501})
 
+# 4xx responses that can succeed on a later attempt; any other 4xx is permanent
+RETRYABLE_CLIENT_STATUSES = frozenset({408, 409, 425, 429})
 
-def _mark_post_failed(post_id: str, error_message: str) -> None:
-    """PATCH the post status to 'failed' after exhausting retries."""
-    with httpx.Client() as client:
+# Shared HTTP client for the Sunday API and n8n, so each job reuses pooled
+# connections instead of paying a fresh TCP/TLS handshake. Jobs are coroutines on
+# the scheduler's event loop, so many in-flight publishes share this one client.
+# Over https the client negotiates HTTP/2 and multiplexes concurrent publishes on one
+# connection per host; plain-http URLs stay on pooled HTTP/1.1 connections.
+_client: httpx.AsyncClient | None = None
+
+# Failed-marks waiting for the current batch window to close. The Sunday API does not
+# have /posts/bulk-fail yet, so the first "unsupported" answer switches back to one
+# PATCH per post for good; any other bulk failure falls back for that batch only.
+_fail_queue: list[tuple[str, str]] = []
+_fail_flush: asyncio.Task[None] | None = None
+_use_bulk_fail = True
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Lazily create the shared client used by publish jobs (keeps connections warm)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared publish client (called on application shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def warm_connections() -> None:
+    """
+    Open pooled connections to the Sunday API and n8n ahead of the first publish.
+
+    Any response, even a 404, leaves a keep-alive connection in the pool, so the first
+    real job skips the TCP/TLS handshake. Failures are harmless and only logged.
+    """
+    client = _get_client()
+    results = await asyncio.gather(
+        client.head(f"{settings.sunday_api_url}/health", timeout=5.0),
+        client.head(settings.n8n_webhook_url, timeout=5.0),
+        return_exceptions=True,
+    )
+    for url, result in zip((settings.sunday_api_url, settings.n8n_webhook_url), results):
+        if isinstance(result, Exception):
+            logger.debug("Connection warm-up to %s failed: %s", url, result)
+
+
+async def _mark_post_failed(post_id: str, error_message: str) -> None:
+    """
+    Mark the post as 'failed' after exhausting retries.
+
+    Marks arriving within FAIL_BATCH_WINDOW_SECONDS of each other (e.g. an n8n outage
+    failing many posts at once) share one bulk request. Returns once the batch is sent.
+    """
+    global _fail_flush
+    _fail_queue.append((post_id, error_message[:MAX_ERROR_MESSAGE_LENGTH]))
+    if _fail_flush is None:
+        _fail_flush = asyncio.create_task(_flush_failed())
+    # Shielded: one cancelled caller must not abort the batch for everyone else
+    await asyncio.shield(_fail_flush)
+
+
+async def _flush_failed() -> None:
+    global _fail_flush, _use_bulk_fail
+    await asyncio.sleep(FAIL_BATCH_WINDOW_SECONDS)
+    _fail_flush = None  # later marks start the next batch
+    batch = _fail_queue[:]
+    _fail_queue.clear()
+
+    if _use_bulk_fail and len(batch) > 1:
         try:
-            client.patch(
-                f"{settings.sunday_api_url}/posts/{post_id}",
-                json={"status": "failed", "errorMessage": error_message},
+            response = await _get_client().post(
+                _POSTS_BASE_URL + "bulk-fail",
+                content=orjson.dumps(
+                    {"posts": [{"id": pid, "errorMessage": msg} for pid, msg in batch]},
+                ),
+                headers=_JSON_HEADERS,
                 timeout=10.0,
             )
-            logger.info("Marked post %s as failed: %s", post_id, error_message)
+            if response.is_success:
+                logger.info("Marked %d posts as failed in one batch", len(batch))
+                return
+            if response.status_code in BULK_FAIL_UNSUPPORTED_STATUSES:
+                logger.info(
+                    "API has no /posts/bulk-fail endpoint (status=%d), "
+                    "falling back to per-post PATCH",
+                    response.status_code,
+                )
+                _use_bulk_fail = False
+            else:
+                logger.warning(
+                    "Bulk fail-mark of %d posts returned %d, retrying per post",
+                    len(batch), response.status_code,
+                )
         except httpx.HTTPError as exc:
-            logger.error("Failed to mark post %s as failed: %s", post_id, exc)
+            logger.warning(
+                "Bulk fail-mark of %d posts failed (%s), retrying per post", len(batch), exc,
+            )
+
+    await asyncio.gather(*(_patch_post_failed(pid, msg) for pid, msg in batch))
+
 
+async def _patch_post_failed(post_id: str, error_message: str) -> None:
+    """PATCH a single post's status to 'failed'."""
+    try:
+        await _get_client().patch(
+            _POSTS_BASE_URL + post_id,
+            content=orjson.dumps({"status": "failed", "errorMessage": error_message}),
+            headers=_JSON_HEADERS,
+            timeout=10.0,
+        )
+        logger.info("Marked post %s as failed: %s", post_id, error_message)
+    except httpx.HTTPError as exc:
+        logger.error("Failed to mark post %s as failed: %s", post_id, exc)
 
-def _schedule_retry(post_id: str, retry_number: int) -> None:
-    """Re-schedule the post for retry after a delay."""
-    from app.scheduler import get_scheduler
 
-    sched = get_scheduler()
-    run_date = datetime.now(timezone.utc) + timedelta(seconds=RETRY_DELAY_SECONDS)
-    job_id = f"post-{post_id}"
+def _elapsed_ms(response: httpx.Response) -> int:
+    return int(response.elapsed.total_seconds() * 1000)
 
-    # Remove existing job if present (the original date trigger is consumed)
-    existing = sched.get_job(job_id)
-    if existing:
-        sched.remove_job(job_id)
 
-    sched.add_job(
+def _decode_head(data: bytes) -> str:
+    return data[:BODY_LOG_LIMIT].decode("utf-8", errors="replace") or "(empty)"
+
+
+async def _read_body_head(response: httpx.Response) -> str:
+    """
+    Keep the first BODY_LOG_LIMIT bytes of a streamed response and drain the rest.
+
+    Raw bytes are read throughout, so the remainder is dropped chunk by chunk without
+    being decompressed or decoded to str. Reading to the end matters: an unfinished
+    HTTP/1.1 body makes httpcore close the connection instead of returning it to the pool.
+    """
+    head = bytearray()
+    async for chunk in response.aiter_raw():
+        if len(head) < BODY_LOG_LIMIT:
+            head += chunk[:BODY_LOG_LIMIT - len(head)]
+    return _decode_head(bytes(head))
+
+
+async def _discard_body(response: httpx.Response) -> None:
+    """Drain a streamed response without keeping it, so its connection stays pooled."""
+    async for _ in response.aiter_raw():
+        pass
+
+
+def _is_retryable(exc: httpx.HTTPError) -> bool:
+    """Connection errors, timeouts and 5xx are transient; most 4xx will never succeed."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        code = exc.response.status_code
+        return not (400 <= code < 500) or code in RETRYABLE_CLIENT_STATUSES
+    return True
+
+
+def _retry_delay_seconds(retry_number: int) -> float:
+    """
+    Exponential backoff with jitter for the given retry (1-based).
+
+    The random factor spreads out posts that failed together (e.g. during an n8n
+    outage) so they don't all hit the recovering service at the same instant.
+    """
+    delay = min(MAX_RETRY_DELAY_SECONDS, RETRY_BASE_SECONDS * (2 ** (retry_number - 1)))
+    return delay * random.uniform(0.5, 1.5)
+
+
+async def _schedule_retry(post_id: str, next_attempt: int, status_marked: bool) -> None:
+    """
+    Re-schedule the post for retry after a backoff delay.
+
+    The retry is a date job whose args carry the attempt number, so the persistent
+    jobstore keeps retry accounting intact across scheduler restarts.
+    """
+    delay = _retry_delay_seconds(next_attempt - 1)
+    run_date = datetime.now(timezone.utc) + timedelta(seconds=delay)
+
+    # replace_existing covers a leftover job under this id in one jobstore call.
+    # Jobstore calls are blocking SQL; keep them off the event loop.
+    await asyncio.to_thread(
+        get_scheduler().add_job,
         trigger_linkedin_publish,
         trigger="date",
         run_date=run_date,
-        args=[post_id],
-        id=job_id,
+        args=[post_id, next_attempt, status_marked],
+        id=post_job_id(post_id),
         replace_existing=True,
     )
     logger.info(
         "Scheduled retry %d/%d for post %s at %s",
-        retry_number, MAX_RETRIES, post_id, run_date.isoformat(),
+        next_attempt - 1, MAX_RETRIES, post_id, run_date.isoformat(),
     )
 
 
-def trigger_linkedin_publish(post_id: str) -> None:
+async def trigger_linkedin_publish(
+    post_id: str, attempt: int = 1, status_marked: bool = False,
+) -> None:
     """
-    Called by APScheduler at the scheduled time.
+    Called by APScheduler at the scheduled time, as a coroutine on its event loop.
     Fires webhook to n8n to initiate LinkedIn publishing.
-    On failure, retries up to MAX_RETRIES times with RETRY_DELAY_SECONDS between attempts.
+    On failure, retries up to MAX_RETRIES times with jittered exponential backoff.
+    ``status_marked`` is set on retries whose earlier attempt already PATCHed the post
+    to "publishing", so the retry goes straight to n8n.
     """
-    retry_count = get_retry_count(post_id)
-    attempt = retry_count + 1
-    logger.info("Triggering publish for post %s (attempt %d/%d)", post_id, attempt, MAX_RETRIES + 1)
+    logger.debug("Triggering publish for post %s (attempt %d/%d)", post_id, attempt, MAX_RETRIES + 1)
 
-    with httpx.Client() as client:
-        try:
-            # Mark post as "publishing" before triggering n8n
-            patch_start = time.monotonic()
-            publish_response = client.patch(
-                f"{settings.sunday_api_url}/posts/{post_id}",
-                json={"status": "publishing"},
+    client = _get_client()
+    response_body: str | None = None
+    patch_duration: int | None = None  # stays None when the PATCH is skipped
+    try:
+        # With n8n_marks_publishing the workflow PATCHes the status itself, saving a
+        # round-trip per job
+        mark_publishing = settings.n8n_marks_publishing
+        if status_marked:
+            logger.debug("Retry attempt for post %s, skipping status PATCH", post_id)
+        elif not mark_publishing:
+            # Mark post as "publishing" before triggering n8n. These two calls must stay
+            # sequential: n8n's completion callback could otherwise race this PATCH.
+            publish_response = await client.patch(
+                _POSTS_BASE_URL + post_id,
+                content=_PUBLISHING_BODY,
+                headers=_JSON_HEADERS,
                 timeout=10.0,
             )
-            patch_duration = round((time.monotonic() - patch_start) * 1000)
+            patch_duration = _elapsed_ms(publish_response)
             publish_response.raise_for_status()
-            logger.info(
-                "Marked post %s as publishing (status=%d, duration=%dms)",
-                post_id, publish_response.status_code, patch_duration,
-            )
+            status_marked = True
 
-            n8n_start = time.monotonic()
-            response = client.post(
-                settings.n8n_webhook_url,
-                json={"postId": post_id},
-                timeout=30.0,
-            )
-            n8n_duration = round((time.monotonic() - n8n_start) * 1000)
+        # Streamed so a large n8n debug response is never held in memory past the log head
+        async with client.stream(
+            "POST",
+            settings.n8n_webhook_url,
+            content=orjson.dumps({"postId": post_id, "markPublishing": mark_publishing}),
+            headers=_N8N_HEADERS,
+            timeout=30.0,
+        ) as response:
+            # Error bodies are only worth the read when DEBUG logging will show them
+            if response.is_success or logger.isEnabledFor(logging.DEBUG):
+                response_body = await _read_body_head(response)
+            else:
+                await _discard_body(response)
             response.raise_for_status()
+        # elapsed is only set once the stream is closed
+        n8n_duration = _elapsed_ms(response)
 
-            # Log n8n response for debugging (truncate if very long)
-            response_text = response.text[:500] if response.text else "(empty)"
-            logger.info(
-                "Successfully triggered n8n for post %s (status=%d, duration=%dms, body=%s)",
-                post_id, response.status_code, n8n_duration, response_text,
-            )
+        # One record per published job: status PATCH and n8n call together
+        logger.info(
+            "Triggered n8n for post %s (attempt=%d, patch_ms=%s, n8n_status=%d, "
+            "n8n_ms=%d, body=%s)",
+            post_id, attempt, patch_duration, response.status_code, n8n_duration,
+            response_body,
+        )
 
-            # Success — clear retry tracking
-            clear_retry_count(post_id)
+    except httpx.HTTPError as exc:
+        # Include the response body in the error log at DEBUG only. The n8n head was
+        # read from the stream above; a failed PATCH response is small and already loaded.
+        if (
+            response_body is None
+            and isinstance(exc, httpx.HTTPStatusError)
+            and logger.isEnabledFor(logging.DEBUG)
+        ):
+            response_body = _decode_head(exc.response.content)
+        logger.error(
+            "Failed to trigger n8n for post %s (attempt %d/%d): %s (response_body=%s)",
+            post_id, attempt, MAX_RETRIES + 1, exc, response_body,
+        )
 
-        except httpx.HTTPError as exc:
-            # Include response body in error log when available
-            response_body = None
-            if hasattr(exc, "response") and exc.response is not None:
-                response_body = exc.response.text[:500] if exc.response.text else "(empty)"
-            logger.error(
-                "Failed to trigger n8n for post %s (attempt %d/%d): %s (response_body=%s)",
-                post_id, attempt, MAX_RETRIES + 1, exc, response_body,
+        if not _is_retryable(exc):
+            # Client error (bad payload, unknown post, ...) — retrying won't help
+            await _mark_post_failed(
+                post_id,
+                f"Non-retryable error on attempt {attempt}: {exc}",
+            )
+        elif attempt <= MAX_RETRIES:
+            # Schedule a retry
+            await _schedule_retry(post_id, attempt + 1, status_marked)
+        else:
+            # Exhausted all retries — mark as failed
+            await _mark_post_failed(
+                post_id,
+                f"Failed after {MAX_RETRIES + 1} attempts. Last error: {exc}",
             )
-
-            if retry_count < MAX_RETRIES:
-                # Schedule a retry
-                _retry_counts[post_id] = retry_count + 1
-                _schedule_retry(post_id, retry_count + 1)
-            else:
-                # Exhausted all retries — mark as failed
-                clear_retry_count(post_id)
-                _mark_post_failed(
-                    post_id,
-                    f"Failed after {MAX_RETRIES + 1} attempts. Last error: {exc}",
-                )
@@ -1,10 +1,15 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
+import anyio.to_thread
 from fastapi import FastAPI
 
 from app.catchup import CATCHUP_INTERVAL_SECONDS, recover_missed_posts
+from app.catchup import close_client as close_catchup_client
+from app.jobs import warm_connections
+from app.jobs import close_client as close_publish_client
 from app.models import HealthResponse
 from app.routes import schedule
 from app.scheduler import get_scheduler
@@ -15,15 +20,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Threads available to sync route handlers (AnyIO's default is 40)
+THREADPOOL_TOKENS = 16
+
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI) -> AsyncGenerator[None, None]:
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_TOKENS
+
+    # Fire-and-forget: handshakes with the Sunday API and n8n overlap the rest of startup
+    warmup = asyncio.create_task(warm_connections())
+
+    # Started from inside the lifespan so the scheduler binds to FastAPI's event loop
     sched = get_scheduler()
     sched.start()
     logger.info("Scheduler started with %d pending jobs", len(sched.get_jobs()))
 
     # Run catch-up for missed posts on startup
-    recovered = recover_missed_posts()
+    recovered = await recover_missed_posts()
     logger.info("Startup catch-up recovered %d post(s)", recovered)
 
     # Schedule periodic catch-up every 5 minutes
@@ -36,9 +50,14 @@ async def lifespan(_app: FastAPI) -> AsyncGenerator[None, None]:
     )
     logger.info("Periodic catch-up scheduled every %d seconds", CATCHUP_INTERVAL_SECONDS)
 
-    yield
-    sched.shutdown()
-    logger.info("Scheduler shut down")
+    try:
+        yield
+    finally:
+        warmup.cancel()
+        sched.shutdown()
+        await close_catchup_client()
+        await close_publish_client()
+        logger.info("Scheduler shut down")
 
 
 app = FastAPI(
@@ -52,7 +71,7 @@ app.include_router(schedule.router, prefix="/schedule", tags=["scheduling"])
 
 
 @app.get("/health", response_model=HealthResponse)
-async def health() -> HealthResponse:
+def health() -> HealthResponse:
     sched = get_scheduler()
     return HealthResponse(
         status="healthy",
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from pydantic import BaseModel, Field
+from pydantic import AliasChoices, BaseModel, Field
 
 
 class ScheduleRequest(BaseModel):
@@ -28,3 +28,12 @@ class HealthResponse(BaseModel):
     status: str
     scheduler_running: bool
     pending_jobs: int
+
+
+class CatchupPost(BaseModel):
+    id: str = Field(..., min_length=1)
+    scheduled_at: datetime = Field(
+        ...,
+        validation_alias=AliasChoices("scheduledAt", "scheduled_at"),
+    )
+    status: str | None = None
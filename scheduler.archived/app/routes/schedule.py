@@ -1,38 +1,42 @@
 import logging
 
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from apscheduler.triggers.date import DateTrigger
 from fastapi import APIRouter, HTTPException
 
 from app.jobs import trigger_linkedin_publish
 from app.models import CancelResponse, RescheduleRequest, ScheduleRequest, ScheduleResponse
-from app.scheduler import get_scheduler
+from app.scheduler import get_scheduler, post_job_id, upsert_job
 
 logger = logging.getLogger(__name__)
 
+# Handlers are plain `def` on purpose: the jobstore calls are blocking SQL, so
+# FastAPI runs them in its threadpool instead of on the event loop.
 router = APIRouter()
 
 
 @router.post("", response_model=ScheduleResponse, status_code=201)
-async def create_schedule(request: ScheduleRequest) -> ScheduleResponse:
+def create_schedule(request: ScheduleRequest) -> ScheduleResponse:
     """Schedule a post for publishing at a specific time."""
     sched = get_scheduler()
-    job_id = f"post-{request.post_id}"
-
-    existing = sched.get_job(job_id)
-    if existing:
+    job_id = post_job_id(request.post_id)
+
+    # The jobstore enforces unique IDs on insert, so no lookup is needed up front
+    try:
+        sched.add_job(
+            trigger_linkedin_publish,
+            trigger="date",
+            run_date=request.scheduled_at,
+            args=[request.post_id],
+            id=job_id,
+            replace_existing=False,
+        )
+    except ConflictingIdError:
         raise HTTPException(
             status_code=409,
             detail=f"Post {request.post_id} is already scheduled",
         )
 
-    sched.add_job(
-        trigger_linkedin_publish,
-        trigger="date",
-        run_date=request.scheduled_at,
-        args=[request.post_id],
-        id=job_id,
-        replace_existing=False,
-    )
-
     logger.info("Scheduled post %s for %s", request.post_id, request.scheduled_at)
 
     return ScheduleResponse(
@@ -44,42 +48,39 @@ async def create_schedule(request: ScheduleRequest) -> ScheduleResponse:
 
 
 @router.delete("/{post_id}", response_model=CancelResponse)
-async def cancel_schedule(post_id: str) -> CancelResponse:
+def cancel_schedule(post_id: str) -> CancelResponse:
     """Cancel a scheduled post."""
     sched = get_scheduler()
-    job_id = f"post-{post_id}"
-    job = sched.get_job(job_id)
+    job_id = post_job_id(post_id)
 
-    if not job:
+    # remove_job() already reports a missing ID, so skip the lookup round-trip
+    try:
+        sched.remove_job(job_id)
+    except JobLookupError:
         raise HTTPException(
             status_code=404,
             detail=f"No schedule found for post {post_id}",
         )
 
-    sched.remove_job(job_id)
     logger.info("Cancelled schedule for post %s", post_id)
 
     return CancelResponse(status="cancelled", post_id=post_id)
 
 
 @router.put("/{post_id}", response_model=ScheduleResponse)
-async def reschedule_post(post_id: str, request: RescheduleRequest) -> ScheduleResponse:
+def reschedule_post(post_id: str, request: RescheduleRequest) -> ScheduleResponse:
     """Reschedule an existing post to a new time."""
     sched = get_scheduler()
-    job_id = f"post-{post_id}"
+    job_id = post_job_id(post_id)
 
-    existing = sched.get_job(job_id)
-    if existing:
-        sched.remove_job(job_id)
-
-    sched.add_job(
-        trigger_linkedin_publish,
-        trigger="date",
-        run_date=request.scheduled_at,
-        args=[post_id],
-        id=job_id,
-        replace_existing=False,
-    )
+    # Move the existing job in place (a single UPDATE); create it if there is none.
+    # Args reset to a fresh first attempt: a pending retry job carries its attempt
+    # count and status_marked flag, which must not leak into the user's new slot.
+    trigger = DateTrigger(run_date=request.scheduled_at, timezone=sched.timezone)
+    try:
+        sched.modify_job(job_id, trigger=trigger, next_run_time=trigger.run_date, args=[post_id])
+    except JobLookupError:
+        upsert_job(job_id, request.scheduled_at, post_id)
 
     logger.info("Rescheduled post %s to %s", post_id, request.scheduled_at)
 
@@ -92,10 +93,10 @@ async def reschedule_post(post_id: str, request: RescheduleRequest) -> ScheduleR
 
 
 @router.get("/{post_id}", response_model=ScheduleResponse)
-async def get_schedule(post_id: str) -> ScheduleResponse:
+def get_schedule(post_id: str) -> ScheduleResponse:
     """Get schedule status for a post."""
     sched = get_scheduler()
-    job_id = f"post-{post_id}"
+    job_id = post_job_id(post_id)
     job = sched.get_job(job_id)
 
     if not job:
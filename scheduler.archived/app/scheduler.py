@@ -1,30 +1,149 @@
-from apscheduler.executors.pool import ThreadPoolExecutor
+import pickle
+from datetime import datetime
+
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.job import Job
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.util import datetime_to_utc_timestamp
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import IntegrityError
 
 from app.config import settings
 
-_scheduler: BackgroundScheduler | None = None
+JOB_ID_PREFIX = "post-"
+
+_scheduler: AsyncIOScheduler | None = None
+
 
+def get_scheduler() -> AsyncIOScheduler:
+    """
+    Lazily create the scheduler on first access (avoids import-time DB connection).
 
-def get_scheduler() -> BackgroundScheduler:
-    """Lazily create the scheduler on first access (avoids import-time DB connection)."""
+    The scheduler attaches to the event loop that calls start(), i.e. FastAPI's loop
+    when started from the lifespan, so coroutine jobs run on it without a thread hop.
+    """
     global _scheduler
     if _scheduler is None:
-        _scheduler = BackgroundScheduler(
-            jobstores={"default": SQLAlchemyJobStore(url=settings.database_url)},
-            executors={"default": ThreadPoolExecutor(max_workers=10)},
+        # Sized for catch-up bursts running alongside API writes (default pool is 5)
+        engine = create_engine(
+            settings.database_url,
+            pool_size=20,
+            max_overflow=10,
+            pool_pre_ping=True,
+        )
+        _scheduler = AsyncIOScheduler(
+            jobstores={"default": SQLAlchemyJobStore(engine=engine, pickle_protocol=5)},
+            # Publish jobs and the catch-up are coroutines multiplexed on the event loop
+            executors={"default": AsyncIOExecutor()},
             job_defaults={
                 "coalesce": False,
                 "max_instances": 1,
-                "misfire_grace_time": 3600,
+                # Long outages are left to the catch-up job rather than replayed at once
+                "misfire_grace_time": 300,
             },
             timezone="UTC",
         )
     return _scheduler
 
 
-def set_scheduler(s: BackgroundScheduler) -> None:
+def set_scheduler(s: AsyncIOScheduler) -> None:
     """Override the scheduler instance (used by tests)."""
     global _scheduler
     _scheduler = s
+
+
+def post_job_id(post_id: str) -> str:
+    """APScheduler job ID for a post's publish job."""
+    return JOB_ID_PREFIX + post_id
+
+
+def find_existing_job_ids(job_ids: list[str]) -> set[str]:
+    """
+    Return the subset of job_ids that are already registered.
+
+    With the SQLAlchemy jobstore this is one primary-key probe
+    (SELECT id ... WHERE id IN (...)) rather than loading and unpickling every job.
+    """
+    if not job_ids:
+        return set()
+
+    sched = get_scheduler()
+    store = sched._lookup_jobstore("default")
+
+    if sched.running and isinstance(store, SQLAlchemyJobStore):
+        query = select(store.jobs_t.c.id).where(store.jobs_t.c.id.in_(job_ids))
+        with store.engine.begin() as connection:
+            return set(connection.execute(query).scalars())
+
+    return {job.id for job in sched.get_jobs(jobstore="default")} & set(job_ids)
+
+
+def upsert_job(job_id: str, run_date: datetime, post_id: str) -> None:
+    """
+    Create or replace the publish job for a post in one call.
+
+    replace_existing=True makes the jobstore fall back to an UPDATE when the ID is
+    taken, so callers don't need a get_job() + remove_job() before adding.
+    """
+    from app.jobs import trigger_linkedin_publish
+
+    get_scheduler().add_job(
+        trigger_linkedin_publish,
+        trigger="date",
+        run_date=run_date,
+        args=[post_id],
+        id=job_id,
+        replace_existing=True,
+    )
+
+
+def add_publish_jobs(entries: list[tuple[str, datetime, str]]) -> None:
+    """
+    Register a batch of publish jobs, given as (job_id, run_date, post_id) tuples.
+
+    With the SQLAlchemy jobstore all rows go out in a single INSERT instead of one
+    round-trip per job. Other jobstores (and a stopped scheduler) fall back to upsert_job().
+    """
+    from app.jobs import trigger_linkedin_publish
+
+    if not entries:
+        return
+
+    sched = get_scheduler()
+    store = sched._lookup_jobstore("default")
+
+    if sched.running and isinstance(store, SQLAlchemyJobStore):
+        rows = []
+        for job_id, run_date, post_id in entries:
+            job = Job(
+                sched,
+                id=job_id,
+                func=trigger_linkedin_publish,
+                trigger=DateTrigger(run_date=run_date, timezone=sched.timezone),
+                executor="default",
+                args=(post_id,),
+                kwargs={},
+                next_run_time=run_date,
+                **sched._job_defaults,
+            )
+            rows.append({
+                "id": job.id,
+                "next_run_time": datetime_to_utc_timestamp(job.next_run_time),
+                "job_state": pickle.dumps(job.__getstate__(), store.pickle_protocol),
+            })
+
+        try:
+            with store.engine.begin() as connection:
+                connection.execute(store.jobs_t.insert(), rows)
+        except IntegrityError:
+            # Another writer registered one of these IDs in the meantime; the
+            # transaction rolled back, so redo the batch with per-job upserts.
+            pass
+        else:
+            sched.wakeup()
+            return
+
+    for job_id, run_date, post_id in entries:
+        upsert_job(job_id, run_date, post_id)
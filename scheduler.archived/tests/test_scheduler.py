@@ -3,32 +3,20 @@
 Uses an in-memory jobstore so no Postgres dependency is needed.
 """
 
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
+import orjson
 import pytest
-from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.executors.asyncio import AsyncIOExecutor
 from apscheduler.jobstores.memory import MemoryJobStore
-from apscheduler.schedulers.background import BackgroundScheduler
-from httpx import ASGITransport, AsyncClient
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from httpx import ASGITransport, AsyncClient, Request, Response
 
-# --- Inject in-memory scheduler BEFORE the app imports it ---
-
-_test_scheduler = BackgroundScheduler(
-    jobstores={"default": MemoryJobStore()},
-    executors={"default": ThreadPoolExecutor(max_workers=5)},
-    job_defaults={
-        "coalesce": False,
-        "max_instances": 1,
-        "misfire_grace_time": 3600,
-    },
-    timezone="UTC",
-)
-
-# Inject immediately so any subsequent get_scheduler() returns the test instance
-from app.scheduler import set_scheduler  # noqa: E402
-
-set_scheduler(_test_scheduler)
+from app.scheduler import get_scheduler, set_scheduler
 
 # Patch recover_missed_posts before importing app to prevent startup catch-up
 # from making real HTTP calls
@@ -36,16 +24,52 @@ with patch("app.main.recover_missed_posts", return_value=0):
     from app.main import app  # noqa: E402
 
 
+def _make_test_scheduler() -> AsyncIOScheduler:
+    return AsyncIOScheduler(
+        jobstores={"default": MemoryJobStore()},
+        executors={"default": AsyncIOExecutor()},
+        job_defaults={
+            "coalesce": False,
+            "max_instances": 1,
+            "misfire_grace_time": 300,
+        },
+        timezone="UTC",
+    )
+
+
+def _n8n_stream(status_code: int = 200, body: bytes = b"ok") -> MagicMock:
+    """Stand-in for AsyncClient.stream that yields a canned, still-unread n8n response."""
+    async def _body():
+        yield body
+
+    response = Response(
+        status_code, content=_body(), request=Request("POST", "http://n8n.test/webhook"),
+    )
+    response.elapsed = timedelta(milliseconds=5)  # httpx sets this when a real stream closes
+
+    @asynccontextmanager
+    async def _stream(*_args, **_kwargs):
+        yield response
+
+    return MagicMock(side_effect=_stream)
+
+
 @pytest.fixture(autouse=True)
-def _reset_scheduler():
-    """Start the scheduler before each test, clean up after."""
-    from app.jobs import _retry_counts
+async def _reset_scheduler():
+    """Start a fresh scheduler on this test's event loop, clean up after."""
+    from app import catchup, jobs
 
-    if not _test_scheduler.running:
-        _test_scheduler.start(paused=False)
+    sched = _make_test_scheduler()
+    set_scheduler(sched)
+    sched.start()
     yield
-    _test_scheduler.remove_all_jobs()
-    _retry_counts.clear()
+    sched.shutdown(wait=False)
+    await asyncio.sleep(0)  # shutdown is queued onto the loop; let it run
+    catchup._last_etag = catchup._last_modified = None
+    catchup._use_missed_endpoint = True
+    jobs._fail_queue.clear()
+    jobs._fail_flush = None
+    jobs._use_bulk_fail = True
 
 
 @pytest.fixture
@@ -164,6 +188,32 @@ async def test_reschedule_post(client: AsyncClient):
     assert resp.status_code == 200
     assert resp.json()["status"] == "rescheduled"
 
+    # The existing job is replaced in place with the new run time
+    job = get_scheduler().get_job("post-resch1")
+    assert job.next_run_time == datetime.fromisoformat(future2)
+
+
+@pytest.mark.anyio
+async def test_reschedule_resets_retry_job_args(client: AsyncClient):
+    """Rescheduling a pending retry should start over at attempt 1 with the status PATCH."""
+    from app.jobs import trigger_linkedin_publish
+
+    get_scheduler().add_job(
+        trigger_linkedin_publish,
+        trigger="date",
+        run_date=datetime.now(timezone.utc) + timedelta(minutes=5),
+        args=["retried1", 3, True],
+        id="post-retried1",
+    )
+
+    future = (datetime.now(timezone.utc) + timedelta(hours=2)).isoformat()
+    resp = await client.put("/schedule/retried1", json={"scheduled_at": future})
+    assert resp.status_code == 200
+
+    job = get_scheduler().get_job("post-retried1")
+    assert tuple(job.args) == ("retried1",)
+    assert job.next_run_time == datetime.fromisoformat(future)
+
 
 @pytest.mark.anyio
 async def test_reschedule_nonexistent_creates_new(client: AsyncClient):
@@ -180,36 +230,97 @@ async def test_reschedule_nonexistent_creates_new(client: AsyncClient):
 # -- Job execution --
 
 
-def test_trigger_linkedin_publish():
+@pytest.mark.anyio
+async def test_trigger_linkedin_publish():
     """Verify the job function patches status to publishing then calls n8n webhook."""
-    with patch("app.jobs.httpx.Client") as MockClient:
+    with patch("app.jobs._get_client") as mock_get_client:
         mock_response = MagicMock()
         mock_response.raise_for_status = MagicMock()
         mock_response.status_code = 200
         mock_response.text = "ok"
 
-        mock_instance = MagicMock()
+        mock_instance = AsyncMock()
         mock_instance.patch.return_value = mock_response
-        mock_instance.post.return_value = mock_response
-        mock_instance.__enter__ = MagicMock(return_value=mock_instance)
-        mock_instance.__exit__ = MagicMock(return_value=False)
+        mock_instance.stream = _n8n_stream()
 
-        MockClient.return_value = mock_instance
+        mock_get_client.return_value = mock_instance
 
         from app.jobs import trigger_linkedin_publish
 
-        trigger_linkedin_publish("test-post-id")
+        await trigger_linkedin_publish("test-post-id")
 
         # Should PATCH status to "publishing" first
         mock_instance.patch.assert_called_once()
         patch_args = mock_instance.patch.call_args
         assert "/posts/test-post-id" in patch_args.args[0]
-        assert patch_args.kwargs["json"] == {"status": "publishing"}
+        assert orjson.loads(patch_args.kwargs["content"]) == {"status": "publishing"}
+        assert patch_args.kwargs["headers"]["Content-Type"] == "application/json"
 
         # Then POST to n8n webhook
-        mock_instance.post.assert_called_once()
-        post_args = mock_instance.post.call_args
-        assert post_args.kwargs["json"] == {"postId": "test-post-id"}
+        mock_instance.stream.assert_called_once()
+        post_args = mock_instance.stream.call_args
+        payload = orjson.loads(post_args.kwargs["content"])
+        assert payload == {"postId": "test-post-id", "markPublishing": False}
+        # An unencoded body keeps the raw bytes read for the log head readable
+        assert post_args.kwargs["headers"]["Accept-Encoding"] == "identity"
+
+
+@pytest.mark.anyio
+async def test_trigger_publish_delegates_status_to_n8n():
+    """With n8n_marks_publishing, the job should skip its PATCH and tell n8n to do it."""
+    with patch("app.jobs._get_client") as mock_get_client, \
+            patch("app.jobs.settings.n8n_marks_publishing", True):
+        mock_instance = AsyncMock()
+        mock_instance.stream = _n8n_stream()
+        mock_get_client.return_value = mock_instance
+
+        from app.jobs import trigger_linkedin_publish
+
+        await trigger_linkedin_publish("delegated-post")
+
+        mock_instance.patch.assert_not_called()
+        post_args = mock_instance.stream.call_args
+        payload = orjson.loads(post_args.kwargs["content"])
+        assert payload == {"postId": "delegated-post", "markPublishing": True}
+
+
+@pytest.mark.anyio
+async def test_trigger_publish_logs_once_on_success(caplog):
+    """A successful publish should emit a single INFO record."""
+    with patch("app.jobs._get_client") as mock_get_client:
+        patch_response = MagicMock()
+        patch_response.raise_for_status = MagicMock()
+
+        mock_instance = AsyncMock()
+        mock_instance.patch.return_value = patch_response
+        mock_instance.stream = _n8n_stream()
+        mock_get_client.return_value = mock_instance
+
+        from app.jobs import trigger_linkedin_publish
+
+        with caplog.at_level("INFO", logger="app.jobs"):
+            await trigger_linkedin_publish("quiet-post")
+
+    records = [r for r in caplog.records if r.name == "app.jobs"]
+    assert len(records) == 1
+    assert "quiet-post" in records[0].getMessage()
+
+
+@pytest.mark.anyio
+async def test_warm_connections_tolerates_unreachable_hosts():
+    """Warm-up should touch both hosts and swallow connection errors."""
+    import httpx as real_httpx
+
+    from app.jobs import warm_connections
+
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
+        mock_instance.head.side_effect = real_httpx.ConnectError("down")
+        mock_get_client.return_value = mock_instance
+
+        await warm_connections()
+
+        assert mock_instance.head.call_count == 2
 
 
 # -- Validation --
@@ -234,56 +345,79 @@ async def test_create_schedule_empty_post_id(client: AsyncClient):
 # -- Retry logic --
 
 
-def test_trigger_publish_retries_on_failure():
+@pytest.mark.anyio
+async def test_trigger_publish_retries_on_failure():
     """On failure, the job should schedule a retry instead of raising."""
-    from app.jobs import _retry_counts, clear_retry_count, trigger_linkedin_publish
+    from app.jobs import trigger_linkedin_publish
 
-    with patch("app.jobs.httpx.Client") as MockClient:
-        mock_instance = MagicMock()
-        mock_response = MagicMock()
-        mock_response.raise_for_status.side_effect = Exception("n8n down")
-        mock_response.status_code = 200
-        mock_response.text = ""
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
 
         # PATCH succeeds, POST to n8n fails
         patch_response = MagicMock()
         patch_response.raise_for_status = MagicMock()
         patch_response.status_code = 200
-
         mock_instance.patch.return_value = patch_response
-        mock_instance.post.return_value = mock_response
-        mock_instance.__enter__ = MagicMock(return_value=mock_instance)
-        mock_instance.__exit__ = MagicMock(return_value=False)
-        MockClient.return_value = mock_instance
+        mock_get_client.return_value = mock_instance
 
         # Simulate httpx.HTTPError on the post call
         import httpx as real_httpx
-        mock_instance.post.side_effect = real_httpx.ConnectError("n8n down")
-
-        trigger_linkedin_publish("retry-post")
+        mock_instance.stream = MagicMock(side_effect=real_httpx.ConnectError("n8n down"))
 
-        # Should have scheduled a retry (retry count incremented)
-        assert _retry_counts.get("retry-post") == 1
+        await trigger_linkedin_publish("retry-post")
 
-        # Should have a retry job in the scheduler
-        job = _test_scheduler.get_job("post-retry-post")
+        # The retry job carries the next attempt number and the already-marked status
+        job = get_scheduler().get_job("post-retry-post")
         assert job is not None
+        assert tuple(job.args) == ("retry-post", 2, True)
 
-        # Clean up
-        clear_retry_count("retry-post")
 
+@pytest.mark.anyio
+async def test_short_retry_is_persisted():
+    """Even a retry due within seconds must be a jobstore job, so a restart keeps it."""
+    import httpx as real_httpx
 
-def test_trigger_publish_marks_failed_after_max_retries():
-    """After MAX_RETRIES, the post should be marked as failed."""
-    from app.jobs import MAX_RETRIES, _retry_counts, trigger_linkedin_publish
+    from app.jobs import trigger_linkedin_publish
 
-    # Pre-set retry count to max so next failure exhausts retries
-    _retry_counts["exhaust-post"] = MAX_RETRIES
+    with patch("app.jobs._get_client") as mock_get_client, \
+            patch("app.jobs._retry_delay_seconds", return_value=1):
+        mock_instance = AsyncMock()
+        # The "publishing" PATCH fails, so the post is still "scheduled"
+        mock_instance.patch.side_effect = real_httpx.ConnectError("api down")
+        mock_get_client.return_value = mock_instance
 
-    with patch("app.jobs.httpx.Client") as MockClient:
-        mock_instance = MagicMock()
-        mock_instance.__enter__ = MagicMock(return_value=mock_instance)
-        mock_instance.__exit__ = MagicMock(return_value=False)
+        await trigger_linkedin_publish("soon-post")
+
+        job = get_scheduler().get_job("post-soon-post")
+        assert tuple(job.args) == ("soon-post", 2, False)
+
+
+@pytest.mark.anyio
+async def test_retry_repeats_status_patch_if_it_failed():
+    """If the "publishing" PATCH itself failed, the retry must PATCH again."""
+    import httpx as real_httpx
+
+    from app.jobs import trigger_linkedin_publish
+
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
+        mock_instance.patch.side_effect = real_httpx.ConnectError("api down")
+        mock_get_client.return_value = mock_instance
+
+        await trigger_linkedin_publish("unmarked-post")
+
+        mock_instance.stream.assert_not_called()
+        job = get_scheduler().get_job("post-unmarked-post")
+        assert tuple(job.args) == ("unmarked-post", 2, False)
+
+
+@pytest.mark.anyio
+async def test_trigger_publish_marks_failed_after_max_retries():
+    """After MAX_RETRIES, the post should be marked as failed."""
+    from app.jobs import MAX_RETRIES, trigger_linkedin_publish
+
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
 
         # PATCH for publishing status succeeds
         patch_response = MagicMock()
@@ -293,52 +427,249 @@ def test_trigger_publish_marks_failed_after_max_retries():
 
         # POST to n8n fails
         import httpx as real_httpx
-        mock_instance.post.side_effect = real_httpx.ConnectError("n8n still down")
+        mock_instance.stream = MagicMock(side_effect=real_httpx.ConnectError("n8n still down"))
 
-        MockClient.return_value = mock_instance
+        mock_get_client.return_value = mock_instance
 
-        trigger_linkedin_publish("exhaust-post")
+        # Final attempt: the next failure exhausts retries
+        await trigger_linkedin_publish("exhaust-post", attempt=MAX_RETRIES + 1)
 
         # Should have called PATCH twice: once for "publishing", once for "failed"
         assert mock_instance.patch.call_count == 2
         fail_call = mock_instance.patch.call_args_list[1]
-        assert fail_call.kwargs["json"]["status"] == "failed"
-        assert "errorMessage" in fail_call.kwargs["json"]
+        assert orjson.loads(fail_call.kwargs["content"])["status"] == "failed"
+        assert "errorMessage" in orjson.loads(fail_call.kwargs["content"])
 
-        # Retry count should be cleared
-        assert "exhaust-post" not in _retry_counts
+        # No further retry should be scheduled
+        assert get_scheduler().get_job("post-exhaust-post") is None
 
 
-def test_trigger_publish_clears_retry_on_success():
-    """On success, retry count should be cleared."""
-    from app.jobs import _retry_counts, trigger_linkedin_publish
-
-    # Simulate a post that already has 1 retry
-    _retry_counts["success-post"] = 1
+@pytest.mark.anyio
+async def test_trigger_publish_success_schedules_no_retry():
+    """A successful retry attempt should not schedule another job."""
+    from app.jobs import trigger_linkedin_publish
 
-    with patch("app.jobs.httpx.Client") as MockClient:
+    with patch("app.jobs._get_client") as mock_get_client:
         mock_response = MagicMock()
         mock_response.raise_for_status = MagicMock()
         mock_response.status_code = 200
         mock_response.text = "ok"
 
-        mock_instance = MagicMock()
+        mock_instance = AsyncMock()
         mock_instance.patch.return_value = mock_response
-        mock_instance.post.return_value = mock_response
-        mock_instance.__enter__ = MagicMock(return_value=mock_instance)
-        mock_instance.__exit__ = MagicMock(return_value=False)
-        MockClient.return_value = mock_instance
+        mock_instance.stream = _n8n_stream()
+        mock_get_client.return_value = mock_instance
 
-        trigger_linkedin_publish("success-post")
+        await trigger_linkedin_publish("success-post", attempt=2)
 
-        # Retry count should be cleared on success
-        assert "success-post" not in _retry_counts
+        assert mock_instance.stream.call_count == 1
+        assert get_scheduler().get_job("post-success-post") is None
+
+
+@pytest.mark.anyio
+async def test_trigger_publish_fails_fast_on_client_error():
+    """A non-retryable 4xx should mark the post failed without scheduling a retry."""
+    from app.jobs import trigger_linkedin_publish
+
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
+
+        patch_response = MagicMock()
+        patch_response.raise_for_status = MagicMock()
+        patch_response.status_code = 200
+        mock_instance.patch.return_value = patch_response
+
+        # n8n rejects the payload outright
+        mock_instance.stream = _n8n_stream(422, b"bad payload")
+        mock_get_client.return_value = mock_instance
+
+        await trigger_linkedin_publish("bad-post")
+
+        assert mock_instance.patch.call_count == 2
+        fail_call = mock_instance.patch.call_args_list[1]
+        assert orjson.loads(fail_call.kwargs["content"])["status"] == "failed"
+        assert get_scheduler().get_job("post-bad-post") is None
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("level, body_logged", [("INFO", False), ("DEBUG", True)])
+async def test_error_body_only_read_at_debug(caplog, level, body_logged):
+    """A failing n8n response body should be read and logged only at DEBUG."""
+    from app.jobs import trigger_linkedin_publish
+
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
+        mock_instance.patch.return_value = MagicMock()
+        mock_instance.stream = _n8n_stream(503, b"n8n stack trace")
+        mock_get_client.return_value = mock_instance
+
+        with caplog.at_level(level, logger="app.jobs"):
+            await trigger_linkedin_publish("noisy-post")
+
+    errors = [r.getMessage() for r in caplog.records if r.levelname == "ERROR"]
+    assert len(errors) == 1
+    assert ("n8n stack trace" in errors[0]) is body_logged
+
+
+@pytest.mark.anyio
+async def test_read_body_head_keeps_head_and_drains_rest():
+    """The head should be capped, but the stream read to the end so the connection is reused."""
+    from app.jobs import BODY_LOG_LIMIT, _read_body_head
+
+    chunks_read = 0
+
+    async def _body():
+        nonlocal chunks_read
+        for _ in range(100):
+            chunks_read += 1
+            yield b"x" * 1024
+
+    head = await _read_body_head(Response(200, content=_body()))
+
+    assert head == "x" * BODY_LOG_LIMIT
+    assert chunks_read == 100
+
+
+@pytest.mark.anyio
+async def test_unlogged_error_body_is_still_drained(caplog):
+    """At INFO the error body isn't logged, but it must be drained to keep the connection."""
+    from app.jobs import trigger_linkedin_publish
+
+    chunks_read = 0
+
+    async def _body():
+        nonlocal chunks_read
+        for _ in range(10):
+            chunks_read += 1
+            yield b"e" * 1024
+
+    response = Response(
+        503, content=_body(), request=Request("POST", "http://n8n.test/webhook"),
+    )
+
+    @asynccontextmanager
+    async def _stream(*_args, **_kwargs):
+        yield response
+
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
+        mock_instance.patch.return_value = MagicMock()
+        mock_instance.stream = MagicMock(side_effect=_stream)
+        mock_get_client.return_value = mock_instance
+
+        with caplog.at_level("INFO", logger="app.jobs"):
+            await trigger_linkedin_publish("drained-post")
+
+    assert chunks_read == 10
+
+
+@pytest.mark.anyio
+async def test_simultaneous_failures_share_one_bulk_request():
+    """Posts failing within the batch window should be marked failed in one request."""
+    from app.jobs import _mark_post_failed
+
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
+        mock_instance.post.return_value = Response(
+            200, request=Request("POST", "http://sunday.test/api/posts/bulk-fail"),
+        )
+        mock_get_client.return_value = mock_instance
+
+        await asyncio.gather(
+            _mark_post_failed("storm-1", "n8n down"),
+            _mark_post_failed("storm-2", "n8n down"),
+        )
+
+        mock_instance.patch.assert_not_called()
+        mock_instance.post.assert_called_once()
+        post_args = mock_instance.post.call_args
+        assert post_args.args[0].endswith("/posts/bulk-fail")
+        posts = orjson.loads(post_args.kwargs["content"])["posts"]
+        assert [p["id"] for p in posts] == ["storm-1", "storm-2"]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("bulk_outcome", ["server_error", "timeout"])
+async def test_bulk_fail_error_retries_batch_per_post(bulk_outcome):
+    """A transient bulk failure should PATCH each post but keep bulk mode on."""
+    import httpx as real_httpx
+
+    from app import jobs
+
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
+        if bulk_outcome == "timeout":
+            mock_instance.post.side_effect = real_httpx.ReadTimeout("slow")
+        else:
+            mock_instance.post.return_value = Response(
+                503, request=Request("POST", "http://sunday.test/api/posts/bulk-fail"),
+            )
+        mock_get_client.return_value = mock_instance
+
+        await asyncio.gather(
+            jobs._mark_post_failed("storm-1", "n8n down"),
+            jobs._mark_post_failed("storm-2", "n8n down"),
+        )
+
+        assert mock_instance.patch.call_count == 2
+        assert jobs._use_bulk_fail is True
+
+
+@pytest.mark.anyio
+async def test_mark_failed_clamps_error_message():
+    """An oversized error message should be truncated before it is sent."""
+    from app.jobs import MAX_ERROR_MESSAGE_LENGTH, _mark_post_failed
+
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
+        mock_get_client.return_value = mock_instance
+
+        await _mark_post_failed("long-error-post", "x" * 10_000)
+
+        payload = orjson.loads(mock_instance.patch.call_args.kwargs["content"])
+        assert len(payload["errorMessage"]) == MAX_ERROR_MESSAGE_LENGTH
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("status_code", [404, 405])
+async def test_bulk_fail_falls_back_to_per_post_patch(status_code):
+    """Without a bulk endpoint, each post should get its own failed PATCH."""
+    from app import jobs
+
+    with patch("app.jobs._get_client") as mock_get_client:
+        mock_instance = AsyncMock()
+        mock_instance.post.return_value = Response(
+            status_code, request=Request("POST", "http://sunday.test/api/posts/bulk-fail"),
+        )
+        mock_get_client.return_value = mock_instance
+
+        await asyncio.gather(
+            jobs._mark_post_failed("storm-1", "n8n down"),
+            jobs._mark_post_failed("storm-2", "n8n down"),
+        )
+
+        assert mock_instance.patch.call_count == 2
+        assert jobs._use_bulk_fail is False
+
+
+def test_retry_delay_backs_off_with_jitter():
+    """Retry delays should grow exponentially, stay within jitter bounds and cap out."""
+    from app.jobs import MAX_RETRY_DELAY_SECONDS, RETRY_BASE_SECONDS, _retry_delay_seconds
+
+    with patch("app.jobs.random.uniform", side_effect=lambda lo, hi: hi):
+        assert _retry_delay_seconds(1) == RETRY_BASE_SECONDS * 1.5
+        assert _retry_delay_seconds(3) == RETRY_BASE_SECONDS * 4 * 1.5
+        assert _retry_delay_seconds(20) == MAX_RETRY_DELAY_SECONDS * 1.5
+
+    for _ in range(50):
+        assert RETRY_BASE_SECONDS * 0.5 <= _retry_delay_seconds(1) <= RETRY_BASE_SECONDS * 1.5
 
 
 # -- Catch-up mechanism --
 
 
-def test_recover_missed_posts():
+@pytest.mark.anyio
+async def test_recover_missed_posts():
     """recover_missed_posts should re-register overdue posts."""
     from app.catchup import recover_missed_posts
 
@@ -348,26 +679,33 @@ def test_recover_missed_posts():
         {"id": "missed-2", "scheduledAt": past_time, "status": "scheduled"},
     ]
 
-    with patch("app.catchup.httpx.Client") as MockClient:
+    with patch("app.catchup._get_client") as mock_get_client:
         mock_response = MagicMock()
         mock_response.raise_for_status = MagicMock()
-        mock_response.json.return_value = mock_posts
+        mock_response.content = orjson.dumps(mock_posts)
         mock_response.status_code = 200
 
         mock_instance = MagicMock()
-        mock_instance.get.return_value = mock_response
-        mock_instance.__enter__ = MagicMock(return_value=mock_instance)
-        mock_instance.__exit__ = MagicMock(return_value=False)
-        MockClient.return_value = mock_instance
+        mock_instance.get = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = mock_instance
 
-        recovered = recover_missed_posts()
+        recovered = await recover_missed_posts()
 
     assert recovered == 2
-    assert _test_scheduler.get_job("post-missed-1") is not None
-    assert _test_scheduler.get_job("post-missed-2") is not None
+    first = get_scheduler().get_job("post-missed-1")
+    second = get_scheduler().get_job("post-missed-2")
+    assert first is not None
+    assert second is not None
 
+    # Recovered posts are spaced out rather than all firing at the same instant
+    from app.catchup import CATCHUP_STAGGER_SECONDS
 
-def test_recover_skips_future_posts():
+    gap = second.next_run_time - first.next_run_time
+    assert gap == timedelta(seconds=CATCHUP_STAGGER_SECONDS)
+
+
+@pytest.mark.anyio
+async def test_recover_skips_future_posts():
     """recover_missed_posts should NOT re-register posts scheduled in the future."""
     from app.catchup import recover_missed_posts
 
@@ -376,24 +714,23 @@ def test_recover_skips_future_posts():
         {"id": "future-1", "scheduledAt": future_time, "status": "scheduled"},
     ]
 
-    with patch("app.catchup.httpx.Client") as MockClient:
+    with patch("app.catchup._get_client") as mock_get_client:
         mock_response = MagicMock()
         mock_response.raise_for_status = MagicMock()
-        mock_response.json.return_value = mock_posts
+        mock_response.content = orjson.dumps(mock_posts)
 
         mock_instance = MagicMock()
-        mock_instance.get.return_value = mock_response
-        mock_instance.__enter__ = MagicMock(return_value=mock_instance)
-        mock_instance.__exit__ = MagicMock(return_value=False)
-        MockClient.return_value = mock_instance
+        mock_instance.get = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = mock_instance
 
-        recovered = recover_missed_posts()
+        recovered = await recover_missed_posts()
 
     assert recovered == 0
-    assert _test_scheduler.get_job("post-future-1") is None
+    assert get_scheduler().get_job("post-future-1") is None
 
 
-def test_recover_skips_already_registered():
+@pytest.mark.anyio
+async def test_recover_skips_already_registered():
     """recover_missed_posts should skip posts that already have a pending job."""
     from app.catchup import recover_missed_posts
     from app.jobs import trigger_linkedin_publish
@@ -401,7 +738,7 @@ def test_recover_skips_already_registered():
     past_time = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
 
     # Pre-register a job for this post
-    _test_scheduler.add_job(
+    get_scheduler().add_job(
         trigger_linkedin_publish,
         trigger="date",
         run_date=datetime.now(timezone.utc) + timedelta(minutes=5),
@@ -413,35 +750,213 @@ def test_recover_skips_already_registered():
         {"id": "already-scheduled", "scheduledAt": past_time, "status": "scheduled"},
     ]
 
-    with patch("app.catchup.httpx.Client") as MockClient:
+    with patch("app.catchup._get_client") as mock_get_client:
         mock_response = MagicMock()
         mock_response.raise_for_status = MagicMock()
-        mock_response.json.return_value = mock_posts
+        mock_response.content = orjson.dumps(mock_posts)
 
         mock_instance = MagicMock()
-        mock_instance.get.return_value = mock_response
-        mock_instance.__enter__ = MagicMock(return_value=mock_instance)
-        mock_instance.__exit__ = MagicMock(return_value=False)
-        MockClient.return_value = mock_instance
+        mock_instance.get = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = mock_instance
 
-        recovered = recover_missed_posts()
+        recovered = await recover_missed_posts()
 
     assert recovered == 0
 
 
-def test_recover_handles_api_error():
+@pytest.mark.anyio
+async def test_recover_dedupes_within_batch():
+    """A post listed twice in one catch-up response should only be recovered once."""
+    from app.catchup import recover_missed_posts
+
+    past_time = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    mock_posts = [
+        {"id": "dupe-1", "scheduledAt": past_time, "status": "scheduled"},
+        {"id": "dupe-1", "scheduledAt": past_time, "status": "scheduled"},
+    ]
+
+    with patch("app.catchup._get_client") as mock_get_client:
+        mock_response = MagicMock()
+        mock_response.raise_for_status = MagicMock()
+        mock_response.content = orjson.dumps(mock_posts)
+
+        mock_instance = MagicMock()
+        mock_instance.get = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = mock_instance
+
+        recovered = await recover_missed_posts()
+
+    assert recovered == 1
+    assert get_scheduler().get_job("post-dupe-1") is not None
+
+
+@pytest.mark.anyio
+async def test_recover_falls_back_when_missed_endpoint_absent():
+    """A 404 from /posts/missed should fall back to the scheduled-posts listing and stick."""
+    from app.catchup import recover_missed_posts
+
+    past_time = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    mock_posts = [{"id": "fallback-1", "scheduledAt": past_time, "status": "scheduled"}]
+
+    with patch("app.catchup._get_client") as mock_get_client:
+        not_found_response = MagicMock()
+        not_found_response.status_code = 404
+
+        mock_response = MagicMock()
+        mock_response.raise_for_status = MagicMock()
+        mock_response.content = orjson.dumps(mock_posts)
+
+        mock_instance = MagicMock()
+        mock_instance.get = AsyncMock(side_effect=[not_found_response, mock_response, mock_response])
+        mock_get_client.return_value = mock_instance
+
+        assert await recover_missed_posts() == 1
+        await recover_missed_posts()
+
+    paths = [call.args[0] for call in mock_instance.get.call_args_list]
+    assert paths == ["/posts/missed", "/posts", "/posts"]
+    assert mock_instance.get.call_args_list[1].kwargs["params"]["status"] == "scheduled"
+
+
+@pytest.mark.anyio
+async def test_recover_skips_malformed_posts():
+    """Rows that fail validation should be dropped without discarding the rest of the batch."""
+    from app.catchup import recover_missed_posts
+
+    past_time = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    mock_posts = [
+        {"id": "valid-1", "scheduledAt": past_time, "status": "scheduled"},
+        {"id": "bad-date", "scheduledAt": "not-a-date", "status": "scheduled"},
+        {"scheduledAt": past_time, "status": "scheduled"},
+    ]
+
+    with patch("app.catchup._get_client") as mock_get_client:
+        mock_response = MagicMock()
+        mock_response.raise_for_status = MagicMock()
+        mock_response.content = orjson.dumps(mock_posts)
+
+        mock_instance = MagicMock()
+        mock_instance.get = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = mock_instance
+
+        recovered = await recover_missed_posts()
+
+    assert recovered == 1
+    assert get_scheduler().get_job("post-valid-1") is not None
+    assert get_scheduler().get_job("post-bad-date") is None
+
+
+@pytest.mark.anyio
+async def test_recover_registers_nothing_on_304():
+    """A 304 response means the missed-post list is unchanged, so nothing is registered."""
+    from app.catchup import recover_missed_posts
+
+    past_time = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    mock_posts = [{"id": "etag-1", "scheduledAt": past_time, "status": "scheduled"}]
+
+    with patch("app.catchup._get_client") as mock_get_client:
+        fresh_response = MagicMock()
+        fresh_response.status_code = 200
+        fresh_response.raise_for_status = MagicMock()
+        fresh_response.content = orjson.dumps(mock_posts)
+        fresh_response.headers = {"ETag": '"v1"'}
+
+        not_modified_response = MagicMock()
+        not_modified_response.status_code = 304
+
+        mock_instance = MagicMock()
+        mock_instance.get = AsyncMock(side_effect=[fresh_response, not_modified_response])
+        mock_get_client.return_value = mock_instance
+
+        assert await recover_missed_posts() == 1
+
+        # Job fired/removed in the meantime; the stale list must not be re-registered
+        get_scheduler().remove_all_jobs()
+        assert await recover_missed_posts() == 0
+        assert get_scheduler().get_job("post-etag-1") is None
+
+    second_call = mock_instance.get.call_args_list[1]
+    assert second_call.kwargs["headers"] == {"If-None-Match": '"v1"'}
+
+
+@pytest.mark.anyio
+async def test_recover_keeps_no_etag_when_registration_fails():
+    """A list that failed to register must be fetched in full again, not revalidated."""
+    from sqlalchemy.exc import OperationalError
+
+    from app.catchup import recover_missed_posts
+
+    past_time = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    mock_posts = [{"id": "etag-2", "scheduledAt": past_time, "status": "scheduled"}]
+
+    with patch("app.catchup._get_client") as mock_get_client, \
+            patch(
+                "app.catchup.add_publish_jobs",
+                side_effect=[OperationalError("INSERT", {}, Exception("db down")), None],
+            ):
+        fresh_response = MagicMock()
+        fresh_response.status_code = 200
+        fresh_response.raise_for_status = MagicMock()
+        fresh_response.content = orjson.dumps(mock_posts)
+        fresh_response.headers = {"ETag": '"v1"'}
+
+        mock_instance = MagicMock()
+        mock_instance.get = AsyncMock(return_value=fresh_response)
+        mock_get_client.return_value = mock_instance
+
+        with pytest.raises(OperationalError):
+            await recover_missed_posts()
+        assert await recover_missed_posts() == 1
+
+    second_call = mock_instance.get.call_args_list[1]
+    assert "If-None-Match" not in second_call.kwargs["headers"]
+
+
+@pytest.mark.anyio
+async def test_recover_handles_api_error():
     """recover_missed_posts should return 0 when the API is unreachable."""
     from app.catchup import recover_missed_posts
 
-    with patch("app.catchup.httpx.Client") as MockClient:
+    with patch("app.catchup._get_client") as mock_get_client:
         import httpx as real_httpx
 
         mock_instance = MagicMock()
-        mock_instance.get.side_effect = real_httpx.ConnectError("API down")
-        mock_instance.__enter__ = MagicMock(return_value=mock_instance)
-        mock_instance.__exit__ = MagicMock(return_value=False)
-        MockClient.return_value = mock_instance
+        mock_instance.get = AsyncMock(side_effect=real_httpx.ConnectError("API down"))
+        mock_get_client.return_value = mock_instance
 
-        recovered = recover_missed_posts()
+        recovered = await recover_missed_posts()
 
     assert recovered == 0
+
+
+@pytest.mark.anyio
+async def test_add_publish_jobs_bulk_inserts_into_sql_jobstore(tmp_path):
+    """add_publish_jobs should write the whole batch to the SQL jobstore at once."""
+    from app.scheduler import add_publish_jobs, find_existing_job_ids, set_scheduler
+
+    previous = get_scheduler()
+    sql_scheduler = AsyncIOScheduler(
+        jobstores={"default": SQLAlchemyJobStore(url=f"sqlite:///{tmp_path}/jobs.db")},
+        timezone="UTC",
+    )
+    sql_scheduler.start(paused=True)
+    set_scheduler(sql_scheduler)
+    try:
+        run_date = datetime.now(timezone.utc) + timedelta(minutes=5)
+        add_publish_jobs([
+            ("post-bulk-1", run_date, "bulk-1"),
+            ("post-bulk-2", run_date, "bulk-2"),
+        ])
+
+        job = sql_scheduler.get_job("post-bulk-1")
+        assert job is not None
+        assert job.args == ("bulk-1",)
+        assert sql_scheduler.get_job("post-bulk-2") is not None
+
+        # The batched ID probe only reports the IDs that exist
+        found = find_existing_job_ids(["post-bulk-1", "post-bulk-2", "post-missing"])
+        assert found == {"post-bulk-1", "post-bulk-2"}
+    finally:
+        set_scheduler(previous)
+        sql_scheduler.shutdown(wait=False)
+        await asyncio.sleep(0)